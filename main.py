@@ -1,76 +1,115 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr, HttpUrl, validator
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, EmailStr, HttpUrl, TypeAdapter, ValidationError, field_validator
 import httpx
-import uuid
+import orjson
 import os
 from typing import Optional
 import logging
-import re
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Environment-driven config so one main.py serves every platform
+# (Render/Railway/local); platform-specific env vars are fallbacks
+PLATFORM = os.getenv("PLATFORM", "Render")
+N8N_WEBHOOK_URL = os.getenv("N8N_WEBHOOK_URL")
+SERVICE_NAME = os.getenv("SERVICE_NAME") or os.getenv("RENDER_SERVICE_NAME")
+EXTERNAL_URL = os.getenv("EXTERNAL_URL") or os.getenv("RENDER_EXTERNAL_URL")
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create one shared httpx client so all requests reuse pooled connections"""
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=5.0),
+        limits=httpx.Limits(
+            max_keepalive_connections=50,
+            max_connections=100,
+            keepalive_expiry=30.0
+        ),
+        # Default headers cover every outbound POST, so call sites don't
+        # rebuild a headers dict per request
+        headers={
+            "User-Agent": "ArticleSummarizer/1.0.0",
+            "Content-Type": "application/json"
+        }
+    )
+    yield
+    # Drain in-flight webhook forwards before closing the client, so a
+    # restart doesn't drop submissions the endpoint already acknowledged
+    if _forward_tasks:
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*_forward_tasks, return_exceptions=True),
+                timeout=HTTP_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Shutdown grace period expired with %d forwards pending", len(_forward_tasks))
+    await app.state.http.aclose()
+
 app = FastAPI(
     title="Article Summarizer API",
     description="Backend service that forwards article processing requests to n8n workflow",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-# CORS middleware - Fixed for Render deployment
+# CORS middleware
+# Keep this the only middleware on the hot path; CORSMiddleware is pure
+# ASGI, whereas BaseHTTPMiddleware subclasses allocate a task group plus
+# streams per request and should not be added here.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
         "http://localhost:3000",  # Local development
         "http://localhost:5173",  # Vite dev server
         "https://smart-summary-mail.vercel.app",  # Your Vercel app
-        "https://*.vercel.app",   # All Vercel deployments
-        "*"  # Allow all origins (remove in production if needed)
     ],
-    allow_credentials=False,  # Set to False when using "*" in origins
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["*"],
-    expose_headers=["*"]
+    # allow_origins does no glob matching, so "https://*.vercel.app" never
+    # matched; preview deployments are covered by this regex instead
+    allow_origin_regex=r"^https://([a-z0-9-]+\.)*vercel\.app$",
+    allow_credentials=True,
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type"],
+    expose_headers=["*"],
+    max_age=86400  # Let browsers cache preflight responses for 24h
 )
 
-# Environment variables - Fixed for Render
-N8N_WEBHOOK_URL = os.getenv("N8N_WEBHOOK_URL")
-RENDER_SERVICE_NAME = os.getenv("RENDER_SERVICE_NAME")
-RENDER_EXTERNAL_URL = os.getenv("RENDER_EXTERNAL_URL")
-
 # Log configuration info
 logger.info(f"Starting Article Summarizer API...")
-logger.info(f"Render Service: {RENDER_SERVICE_NAME}")
-logger.info(f"Render External URL: {RENDER_EXTERNAL_URL}")
+logger.info(f"Platform: {PLATFORM}")
+logger.info(f"Service: {SERVICE_NAME}")
+logger.info(f"External URL: {EXTERNAL_URL}")
 logger.info(f"N8N Webhook URL configured: {'✅' if N8N_WEBHOOK_URL else '❌'}")
 
 if not N8N_WEBHOOK_URL:
-    logger.warning("⚠️  N8N_WEBHOOK_URL not set. Please configure it in Render environment variables.")
-    logger.warning("   Go to Render Dashboard → Your Service → Environment → Add N8N_WEBHOOK_URL")
-else:
-    logger.info(f"✅ N8N Webhook URL configured")
+    logger.warning("⚠️  N8N_WEBHOOK_URL not set. Please configure it in your platform's environment variables.")
+
+# pydantic-core's Rust URL parser, built once and shared across requests
+_HTTP_URL = TypeAdapter(HttpUrl)
 
 def validate_url(url_str: str) -> str:
     """Validate and clean URL"""
     url_str = url_str.strip()
-    
+
     # Add protocol if missing
     if not url_str.startswith(('http://', 'https://')):
         url_str = 'https://' + url_str
-    
-    # Basic URL validation
-    url_pattern = re.compile(
-        r'^https?://'  # http:// or https://
-        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # domain...
-        r'localhost|'  # localhost...
-        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
-        r'(?::\d+)?'  # optional port
-        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-    
-    if not url_pattern.match(url_str):
+
+    try:
+        _HTTP_URL.validate_python(url_str)
+    except ValueError:
         raise ValueError("Invalid URL format")
-    
+
     return url_str
 
 # Request/Response models
@@ -78,8 +117,9 @@ class ArticleSubmission(BaseModel):
     email: EmailStr
     article_url: str  # Changed from HttpUrl to str for custom validation
     
-    @validator('article_url')
-    def validate_article_url(cls, v):
+    @field_validator('article_url')
+    @classmethod
+    def validate_article_url(cls, v: str) -> str:
         try:
             return validate_url(v)
         except ValueError as e:
@@ -96,20 +136,14 @@ class HealthCheck(BaseModel):
     service_name: Optional[str] = None
     external_url: Optional[str] = None
 
-# Add explicit OPTIONS handler for CORS preflight
-@app.options("/{path:path}")
-async def options_handler(path: str):
-    """Handle CORS preflight requests"""
-    return {"message": "OK"}
-
-@app.get("/", response_model=dict)
+@app.get("/")
 async def root():
     """Root endpoint with API information"""
     return {
         "message": "Article Summarizer API",
         "version": "1.0.0",
-        "platform": "Render",
-        "service": RENDER_SERVICE_NAME,
+        "platform": PLATFORM,
+        "service": SERVICE_NAME,
         "endpoints": {
             "health": "/health",
             "submit": "/submit",
@@ -123,98 +157,111 @@ async def health_check():
     return HealthCheck(
         status="healthy",
         version="1.0.0",
-        service_name=RENDER_SERVICE_NAME,
-        external_url=RENDER_EXTERNAL_URL
+        service_name=SERVICE_NAME,
+        external_url=EXTERNAL_URL
     )
 
-@app.post("/submit", response_model=SubmissionResponse)
-async def submit_article(submission: ArticleSubmission):
+# Bound how many webhook forwards run at once so a slow n8n can't pile
+# up unbounded tasks; pending tasks are kept alive in _forward_tasks
+_N8N_SEM = asyncio.Semaphore(100)
+_forward_tasks: set = set()
+
+async def _forward_to_n8n(payload: dict, session_id: str):
+    """Forward a submission payload to the n8n webhook in the background"""
+    async with _N8N_SEM:
+        try:
+            # Stream so the body is never read on success; on failure read
+            # just enough for the log instead of decoding the whole response
+            async with app.state.http.stream(
+                "POST",
+                N8N_WEBHOOK_URL,
+                content=orjson.dumps(payload)
+            ) as response:
+                if response.status_code not in [200, 201]:
+                    body = b""
+                    async for chunk in response.aiter_bytes():
+                        body += chunk
+                        if len(body) > 1024:
+                            break
+                    logger.warning("n8n webhook returned status %s: %r", response.status_code, body[:1024])
+        except Exception:
+            logger.exception("n8n forward failed - Session ID: %s", session_id)
+
+@app.post(
+    "/submit",
+    response_model=SubmissionResponse,
+    # The body is read manually below, so document its schema explicitly
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "application/json": {"schema": ArticleSubmission.model_json_schema()}
+            },
+            "required": True
+        }
+    }
+)
+async def submit_article(request: Request):
     """
     Submit article for processing via n8n workflow
-    
+
     This endpoint:
     1. Validates and formats the URL
     2. Generates a unique session ID
-    3. Forwards the request to n8n webhook
-    4. Returns success response to frontend
+    3. Forwards the request to n8n webhook in the background
+    4. Returns success response to frontend immediately
+
+    CORS note: browsers cache the preflight for 24h (max_age on
+    CORSMiddleware). The frontend can skip the preflight entirely by
+    POSTing the JSON body with Content-Type: text/plain, which makes
+    this a CORS "simple request"; the body is parsed as JSON regardless
+    of the declared content type.
     """
-    
+
+    try:
+        submission = ArticleSubmission.model_validate_json(await request.body())
+    except ValidationError as e:
+        # Re-prefix loc with "body" to match FastAPI's own 422 shape
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        )
+
     if not N8N_WEBHOOK_URL:
         logger.error("N8N_WEBHOOK_URL not configured")
         raise HTTPException(
             status_code=500,
             detail="Service configuration error. Please contact administrator."
         )
-    
-    # Generate unique session ID
-    session_id = str(uuid.uuid4())
-    
+
+    # Generate unique session ID (raw hex, skips UUID object construction)
+    session_id = os.urandom(16).hex()
+
     # URL is already validated by pydantic validator
     article_url_str = submission.article_url
-    
-    # Log for debugging
-    logger.info(f"Processing article submission - Session ID: {session_id}")
-    logger.info(f"Email: {submission.email}")
-    logger.info(f"Validated URL: {article_url_str}")
-    
+
+    # Only log at debug; the payload itself (email address) stays out of logs
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Processing submission - Session ID: %s, URL: %s", session_id, article_url_str)
+
     # Prepare payload for n8n
     n8n_payload = {
         "email": str(submission.email),
         "article_url": article_url_str,
         "session_id": session_id
     }
-    
-    logger.info(f"Sending payload to n8n webhook")
-    
-    try:
-        # Forward to n8n webhook with proper timeout for Render
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                N8N_WEBHOOK_URL,
-                json=n8n_payload,
-                headers={
-                    "Content-Type": "application/json",
-                    "User-Agent": "ArticleSummarizer-Render/1.0.0"
-                }
-            )
-            
-            # Log n8n response for debugging
-            logger.info(f"n8n response status: {response.status_code}")
-            
-            if response.status_code not in [200, 201]:
-                logger.warning(f"n8n webhook returned status {response.status_code}: {response.text}")
-                # Don't fail immediately as n8n might still process it async
-            else:
-                logger.info("Successfully sent to n8n webhook")
-        
-        logger.info(f"Request processed - Session ID: {session_id}")
-        
-        return SubmissionResponse(
-            success=True,
-            message="Article submitted successfully. You'll receive the summary by email shortly.",
-            session_id=session_id
-        )
-        
-    except httpx.TimeoutException:
-        logger.error(f"Timeout while calling n8n webhook - Session ID: {session_id}")
-        # Return success anyway as the request might still be processing
-        return SubmissionResponse(
-            success=True,
-            message="Article submitted successfully. Processing may take a few minutes. Check your email.",
-            session_id=session_id
-        )
-    except httpx.RequestError as e:
-        logger.error(f"Network error while calling n8n webhook: {str(e)} - Session ID: {session_id}")
-        raise HTTPException(
-            status_code=503,
-            detail="Service temporarily unavailable. Please try again later."
-        )
-    except Exception as e:
-        logger.error(f"Unexpected error: {str(e)} - Session ID: {session_id}")
-        raise HTTPException(
-            status_code=500,
-            detail="An unexpected error occurred. Please try again later."
-        )
+
+    # Acknowledge immediately; the client gets the same response whether or
+    # not n8n has answered yet, so don't hold the request slot on it
+    task = asyncio.create_task(_forward_to_n8n(n8n_payload, session_id))
+    _forward_tasks.add(task)
+    task.add_done_callback(_forward_tasks.discard)
+
+    # Returning a Response directly skips FastAPI's response-model
+    # validation pass; response_model above still documents the schema
+    return ORJSONResponse({
+        "success": True,
+        "message": "Article submitted successfully. You'll receive the summary by email shortly.",
+        "session_id": session_id
+    })
 
 if __name__ == "__main__":
     import uvicorn
@@ -222,6 +269,10 @@ if __name__ == "__main__":
     # Render provides PORT environment variable
     port = int(os.getenv("PORT", 10000))
     host = "0.0.0.0"
+
+    # One worker per core unless overridden; the app is stateless and the
+    # httpx client is created in lifespan, so each worker gets its own pool
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
     
     logger.info(f"🚀 Starting server on {host}:{port}")
     logger.info(f"🌍 CORS configured for production")
@@ -231,7 +282,10 @@ if __name__ == "__main__":
         "main:app",
         host=host,
         port=port,
+        workers=workers,
+        loop="uvloop",  # Cython event loop, ships with uvicorn[standard]
+        http="httptools",  # C HTTP parser instead of pure-Python h11
         reload=False,  # Always False in production
-        log_level="info",
-        access_log=True
+        log_level="warning",
+        access_log=False  # Per-request access lines cost formatting + I/O under the loop
     )